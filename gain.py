@@ -0,0 +1,123 @@
+"""
+Post-gain kernels for 16-bit signed PCM.
+
+In order of preference: the AVX2 C kernel (gain_avx2.c, if the shared
+library has been built), the Numba kernel (if numba is installed), the
+NumPy implementation, and a pure-Python loop for environments without NumPy.
+"""
+
+from __future__ import annotations
+
+import array
+import ctypes
+import os
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import numba  # type: ignore
+except ImportError:
+    numba = None
+
+
+def _gain_numpy(arr: np.ndarray, gain: float, out: np.ndarray) -> None:
+    # Widen to int32 so the multiply can't wrap, then saturate
+    np.copyto(out, np.clip(arr.astype(np.int32) * gain, -32768, 32767), casting="unsafe")
+
+
+def _gain_python(pcm_bytes: bytes, gain: float) -> array.array:
+    a = array.array("h")
+    a.frombytes(pcm_bytes)
+    # Single clamp expression per sample; min/max bound locally to skip global lookups
+    lo, hi, _min, _max = -32768, 32767, min, max
+    return array.array("h", [_min(hi, _max(lo, int(v * gain))) for v in a])
+
+
+_gain_kernel = None
+
+if numba is not None and np is not None:
+    # Serial on purpose: chunks are one sentence and the loop is memory-bound, and
+    # parallel=True aborts the process when threadpool threads call it concurrently
+    # under Numba's fallback workqueue threading layer
+    @numba.njit(fastmath=True, cache=True)
+    def _gain_kernel(arr, gain, out):
+        for i in range(arr.shape[0]):
+            v = np.int32(arr[i]) * gain
+            if v > 32767:
+                out[i] = 32767
+            elif v < -32768:
+                out[i] = -32768
+            else:
+                out[i] = np.int16(v)
+
+    # Pay the JIT cost once at import instead of on the first request. Requests pass a
+    # read-only np.frombuffer() view, which Numba compiles as a separate signature.
+    try:
+        _gain_kernel(np.frombuffer(b"\0\0", dtype=np.int16), np.float32(1.0), np.empty(1, dtype=np.int16))
+    except Exception as e:
+        print(f"[WARN] Numba gain kernel unavailable, using NumPy: {e}", file=sys.stderr)
+        _gain_kernel = None
+
+
+# Shared library built from gain_avx2.c; override the location with PIPER_GAIN_LIB
+GAIN_LIB_PATH = os.getenv(
+    "PIPER_GAIN_LIB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "libgain_avx2.so")
+)
+
+
+def _load_native():
+    if not os.path.exists(GAIN_LIB_PATH):
+        return None
+    try:
+        lib = ctypes.CDLL(GAIN_LIB_PATH)
+    except OSError as e:
+        print(f"[WARN] Failed to load native gain kernel {GAIN_LIB_PATH}: {e}", file=sys.stderr)
+        return None
+    fn = lib.apply_gain_i16
+    fn.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_float]
+    fn.restype = None
+    return fn
+
+
+_native_gain = _load_native()
+
+
+def _gain(arr: np.ndarray, gain: float, out: np.ndarray) -> None:
+    if _native_gain is not None and gain >= 0:
+        _native_gain(arr.ctypes.data, out.ctypes.data, out.size, gain)
+    elif _gain_kernel is not None:
+        _gain_kernel(arr, np.float32(gain), out)
+    else:
+        _gain_numpy(arr, gain, out)
+
+
+def apply_gain(pcm_bytes: bytes, gain: float) -> memoryview:
+    """
+    Scale 16-bit signed PCM bytes by ``gain``, saturating to the int16 range.
+    Returns a byte view of a new buffer (no extra copy into a ``bytes`` object).
+    """
+    if np is None:
+        return memoryview(_gain_python(pcm_bytes, gain)).cast("B")
+    arr = np.frombuffer(pcm_bytes, dtype=np.int16)
+    out = np.empty_like(arr)
+    _gain(arr, gain, out)
+    return memoryview(out).cast("B")
+
+
+def apply_gain_into(pcm_bytes: bytes, dst: bytearray, gain: float) -> int:
+    """
+    Like :func:`apply_gain`, but write the result into the start of the writable
+    buffer ``dst`` (at least ``len(pcm_bytes)`` long). Returns the number of bytes written.
+    """
+    if np is None:
+        n = len(pcm_bytes)
+        memoryview(dst)[:n] = _gain_python(pcm_bytes, gain).tobytes()
+        return n
+    arr = np.frombuffer(pcm_bytes, dtype=np.int16)
+    out = np.frombuffer(dst, dtype=np.int16, count=arr.size)
+    _gain(arr, gain, out)
+    return arr.nbytes
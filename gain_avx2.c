@@ -0,0 +1,89 @@
+/*
+ * AVX2 post-gain kernel for 16-bit signed PCM, loaded by gain.py via ctypes.
+ *
+ * Build:
+ *   cc -O3 -shared -fPIC -o libgain_avx2.so gain_avx2.c
+ *
+ * The gain is split into an integer multiplier k and a Q15 fraction q, so
+ * each sample becomes sat16(sat16(s * k) + mulhrs(s, q)). For gain <= 1.0
+ * k is 0 and the whole operation is a single rounding Q15 multiply.
+ *
+ * The AVX2 path is compiled with a target attribute and selected at runtime,
+ * so the library is safe to load on CPUs without AVX2 (and builds on non-x86
+ * hosts, where only the scalar path exists).
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#define GAIN_HAVE_X86 1
+#endif
+
+static inline int32_t sat16(int32_t v)
+{
+    return v > 32767 ? 32767 : (v < -32768 ? -32768 : v);
+}
+
+/* Rounding Q15 multiply; matches _mm256_mulhrs_epi16 lane for lane. */
+static inline int32_t mulhrs(int16_t a, int16_t b)
+{
+    return ((int32_t)a * b + 0x4000) >> 15;
+}
+
+static void gain_scalar(const int16_t *src, int16_t *dst, size_t n, int32_t k, int16_t q)
+{
+    for (size_t i = 0; i < n; i++)
+        dst[i] = (int16_t)sat16(sat16((int32_t)src[i] * k) + mulhrs(src[i], q));
+}
+
+#ifdef GAIN_HAVE_X86
+__attribute__((target("avx2")))
+static void gain_avx2(const int16_t *src, int16_t *dst, size_t n, int32_t k, int16_t q)
+{
+    const __m256i vq = _mm256_set1_epi16(q);
+    const __m256i vk = _mm256_set1_epi32(k);
+    size_t i = 0;
+
+    for (; i + 16 <= n; i += 16) {
+        __m256i s = _mm256_loadu_si256((const __m256i *)(src + i));
+        __m256i out = _mm256_mulhrs_epi16(s, vq);
+        if (k) {
+            __m256i lo = _mm256_mullo_epi32(_mm256_cvtepi16_epi32(_mm256_castsi256_si128(s)), vk);
+            __m256i hi = _mm256_mullo_epi32(_mm256_cvtepi16_epi32(_mm256_extracti128_si256(s, 1)), vk);
+            /* packs saturates per 128-bit lane; restore sample order afterwards */
+            __m256i whole = _mm256_permute4x64_epi64(_mm256_packs_epi32(lo, hi), 0xD8);
+            out = _mm256_adds_epi16(whole, out);
+        }
+        _mm256_storeu_si256((__m256i *)(dst + i), out);
+    }
+    gain_scalar(src + i, dst + i, n - i, k, q);
+}
+#endif
+
+/*
+ * Scale n samples from src into dst by gain (>= 0), saturating to int16.
+ * src and dst may be the same buffer (in place); otherwise they must not overlap.
+ */
+void apply_gain_i16(const int16_t *src, int16_t *dst, size_t n, float gain)
+{
+    if (!(gain > 0.0f))
+        gain = 0.0f;
+
+    /* Cap k so s * k always fits in int32 */
+    int32_t k = gain >= 65536.0f ? 65536 : (int32_t)gain;
+    int32_t q = k == 65536 ? 0 : (int32_t)((gain - (float)k) * 32768.0f + 0.5f);
+    if (q > 32767) {
+        k += 1;
+        q = 0;
+    }
+
+#ifdef GAIN_HAVE_X86
+    if (__builtin_cpu_supports("avx2")) {
+        gain_avx2(src, dst, n, k, (int16_t)q);
+        return;
+    }
+#endif
+    gain_scalar(src, dst, n, k, (int16_t)q);
+}
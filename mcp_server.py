@@ -8,13 +8,14 @@ It exposes text-to-speech capabilities as MCP tools that can be used by MCP-comp
 
 import asyncio
 import base64
-import io
-import json
 import os
+import re
 import tempfile
-import wave
+import time
+from pathlib import Path
 from typing import Any, Dict, List, Optional, Sequence
 
+from fastapi.concurrency import run_in_threadpool
 from mcp.server import Server, NotificationOptions
 from mcp.server.models import InitializationOptions
 from mcp.server.stdio import stdio_server
@@ -27,15 +28,27 @@ from mcp.types import (
 )
 from pydantic import AnyUrl
 
-# Import the existing Piper functionality
-from main import (
+# Import the shared Piper functionality
+from piper_core import (
     VOICES,
+    VOICE_CONFIGS,
+    _build_synthesis_config,
     _load_voice,
-    _get_sample_rate,
-    _apply_post_gain,
+    _render_wav,
+    _write_wav,
     SynthesisRequest,
 )
 
+# Synthesized audio is written here and returned as a file:// URI, instead of
+# inlining base64 WAV data (4/3 larger and an extra full pass over the audio)
+AUDIO_DIR = os.getenv("PIPER_MCP_AUDIO_DIR", os.path.join(tempfile.gettempdir(), "piper-mcp"))
+
+# Audio files older than this many seconds are removed on the next synthesis
+AUDIO_TTL = float(os.getenv("PIPER_MCP_AUDIO_TTL", "3600"))
+
+# Return base64-encoded audio in the tool result instead of a file URI
+INLINE_AUDIO = os.getenv("PIPER_MCP_INLINE_AUDIO", "0") == "1"
+
 # MCP Server instance
 server = Server("piper-tts")
 
@@ -46,7 +59,11 @@ async def handle_list_tools() -> List[Tool]:
     tools = [
         Tool(
             name="text_to_speech",
-            description="Convert text to speech using Piper TTS. Returns base64-encoded WAV audio.",
+            description=(
+                "Convert text to speech using Piper TTS. Returns base64-encoded WAV audio."
+                if INLINE_AUDIO else
+                "Convert text to speech using Piper TTS. Writes a WAV file and returns its file:// URI."
+            ),
             inputSchema={
                 "type": "object",
                 "properties": {
@@ -176,55 +193,39 @@ async def _handle_text_to_speech(arguments: Dict[str, Any]) -> List[TextContent]
         )
         
         # Load voice and get sample rate
-        voice = _load_voice(voice_name)
-        sr = _get_sample_rate(voice)
-        
-        # Handle rate conversion to length_scale
-        length_scale = req.length_scale
-        if req.rate and not length_scale:
-            try:
-                length_scale = 1.0 / float(req.rate)
-            except Exception:
-                pass
+        voice, sr, _ = await run_in_threadpool(_load_voice, voice_name)
         
         # Build synthesis config
-        import piper
-        syn_config = None
-        if any([req.speaker is not None, req.noise_scale is not None, length_scale is not None, 
-                req.noise_w is not None, req.sentence_silence is not None]):
-            syn_config = piper.SynthesisConfig()
-            if req.speaker is not None:          syn_config.speaker_id = req.speaker
-            if req.noise_scale is not None:      syn_config.noise_scale = float(req.noise_scale)
-            if length_scale is not None:         syn_config.length_scale = float(length_scale)
-            if req.noise_w is not None:          syn_config.noise_w = float(req.noise_w)
-            if req.sentence_silence is not None: syn_config.sentence_silence = float(req.sentence_silence)
+        syn_config = _build_synthesis_config(req)
         
-        # Synthesize audio
-        buf = io.BytesIO()
-        with wave.open(buf, "wb") as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)  # 16-bit signed
-            wf.setframerate(sr)
-            
-            for chunk in voice.synthesize(req.text, syn_config):
-                audio_data = chunk.audio_int16_bytes
-                if req.volume and abs(req.volume - 1.0) > 1e-6:
-                    audio_data = _apply_post_gain(audio_data, req.volume)
-                wf.writeframes(audio_data)
+        summary = (f"Successfully synthesized speech for text: '{text[:50]}{'...' if len(text) > 50 else ''}'\n"
+                   f"Voice: {voice_name}\n"
+                   f"Audio format: WAV, 16-bit, {sr}Hz, mono\n")
         
-        audio_bytes = buf.getvalue()
+        # Synthesize audio in a worker thread so the MCP event loop stays responsive
+        if INLINE_AUDIO:
+            audio_bytes = await run_in_threadpool(_render_wav, voice, sr, req.text, syn_config, req.volume)
+            
+            # Encode audio as base64
+            audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+            
+            return [
+                TextContent(
+                    type="text",
+                    text=summary +
+                         f"Audio size: {len(audio_bytes)} bytes\n"
+                         f"Base64 encoded audio:\n{audio_b64}"
+                )
+            ]
         
-        # Encode audio as base64
-        audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+        path = await run_in_threadpool(_synthesize_to_file, voice_name, voice, sr, req.text, syn_config, req.volume)
         
         return [
             TextContent(
                 type="text",
-                text=f"Successfully synthesized speech for text: '{text[:50]}{'...' if len(text) > 50 else ''}'\n"
-                     f"Voice: {voice_name}\n"
-                     f"Audio format: WAV, 16-bit, {sr}Hz, mono\n"
-                     f"Audio size: {len(audio_bytes)} bytes\n"
-                     f"Base64 encoded audio:\n{audio_b64}"
+                text=summary +
+                     f"Audio size: {os.path.getsize(path)} bytes\n"
+                     f"Audio file: {Path(path).as_uri()}"
             )
         ]
         
@@ -237,6 +238,42 @@ async def _handle_text_to_speech(arguments: Dict[str, Any]) -> List[TextContent]
         ]
 
 
+def _synthesize_to_file(voice_name: str, voice, sr: int, text: str, syn_config, volume: Optional[float]) -> str:
+    """Synthesize straight into a new WAV file in AUDIO_DIR and return its path."""
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    _cleanup_audio_dir()
+    f = tempfile.NamedTemporaryFile(prefix=f"{voice_name}-", suffix=".wav", dir=AUDIO_DIR, delete=False)
+    try:
+        with f:
+            _write_wav(f, voice, sr, text, syn_config, volume)
+    except Exception:
+        os.unlink(f.name)
+        raise
+    # The client reading the file may run as another user (e.g. with the Docker image)
+    os.chmod(f.name, 0o644)
+    return f.name
+
+
+# Names produced by _synthesize_to_file: <voice>-<8 random tempfile chars>.wav
+_AUDIO_FILE_RE = re.compile(r"(?P<voice>.+)-[a-z0-9_]{8}\.wav")
+
+
+def _cleanup_audio_dir() -> None:
+    """Remove audio files this server wrote to AUDIO_DIR that are older than AUDIO_TTL."""
+    cutoff = time.time() - AUDIO_TTL
+    with os.scandir(AUDIO_DIR) as entries:
+        for entry in entries:
+            # AUDIO_DIR may be a directory the user keeps other files in; only touch our own
+            m = _AUDIO_FILE_RE.fullmatch(entry.name)
+            if m is None or m.group("voice") not in VOICES:
+                continue
+            try:
+                if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
 async def _handle_list_voices(arguments: Dict[str, Any]) -> List[TextContent]:
     """Handle listing available voices."""
     try:
@@ -250,18 +287,14 @@ async def _handle_list_voices(arguments: Dict[str, Any]) -> List[TextContent]:
         
         voice_info = []
         for voice_name, model_path in VOICES.items():
-            config_path = model_path + ".json"
-            config_info = "No config info available"
+            config = VOICE_CONFIGS.get(voice_name)
             
-            if os.path.exists(config_path):
-                try:
-                    with open(config_path, 'r') as f:
-                        config = json.load(f)
-                        language = config.get('language', 'unknown')
-                        dataset = config.get('dataset', 'unknown')
-                        config_info = f"Language: {language}, Dataset: {dataset}"
-                except Exception:
-                    config_info = "Config file exists but couldn't be read"
+            if config is not None:
+                language = config.get('language', 'unknown')
+                dataset = config.get('dataset', 'unknown')
+                config_info = f"Language: {language}, Dataset: {dataset}"
+            else:
+                config_info = "Config file exists but couldn't be read"
             
             voice_info.append(f"• **{voice_name}**: {model_path}\n  {config_info}")
         
@@ -294,15 +327,12 @@ async def _handle_get_voice_info(arguments: Dict[str, Any]) -> List[TextContent]
             raise ValueError(f"Voice '{voice_name}' not found. Available voices: {available_voices}")
         
         model_path = VOICES[voice_name]
-        config_path = model_path + ".json"
+        config = VOICE_CONFIGS.get(voice_name)
         
         info = [f"**Voice**: {voice_name}", f"**Model Path**: {model_path}"]
         
-        if os.path.exists(config_path):
+        if config is not None:
             try:
-                with open(config_path, 'r') as f:
-                    config = json.load(f)
-                
                 info.extend([
                     f"**Language**: {config.get('language', 'unknown')}",
                     f"**Dataset**: {config.get('dataset', 'unknown')}",
@@ -322,9 +352,9 @@ async def _handle_get_voice_info(arguments: Dict[str, Any]) -> List[TextContent]
                     info.append(f"**eSpeak Voice**: {config['espeak'].get('voice', 'unknown')}")
                 
             except Exception as e:
-                info.append(f"**Config Error**: Could not read config file: {str(e)}")
+                info.append(f"**Config Error**: Unexpected config contents: {str(e)}")
         else:
-            info.append("**Config**: No config file found")
+            info.append("**Config Error**: Could not read config file")
         
         return [
             TextContent(
@@ -0,0 +1,231 @@
+"""
+Request coalescing for short synthesis requests.
+
+With PIPER_BATCH_WINDOW_MS > 0, /synthesize requests are collected for up to
+that many milliseconds and grouped per voice and synthesis scales (at most
+PIPER_BATCH_MAX requests per group). A group's sentences are phonemized,
+sorted by length and run through the voice's ONNX session as padded
+[batch, phonemes] inputs with their real ``input_lengths``, so one
+session.run() covers up to PIPER_BATCH_MAX sentences of similar length.
+
+Piper exports its models with a dynamic batch axis, but the audio output is
+padded to the longest item of the batch. Each item is trimmed to
+sum(w_ceil[b]) * hop_length samples, using the per-phoneme-id frame counts
+that _open_voice exposes as an extra session output (the same patch as
+piper.patch_voice_with_alignment). A model that can't be patched (e.g. the
+onnx package isn't installed) is run one sentence per call instead.
+
+Caveats of variable-length VITS batching:
+- Every item is computed for the full padded length, so sentences only share
+  a call while their lengths are within PIPER_BATCH_MAX_PADDING of each other.
+- ``scales`` is a single input for the whole batch, so requests with different
+  noise/length scales never share a call.
+- Coalesced requests return a complete WAV rather than a streamed one, after
+  waiting up to one window.
+"""
+
+import asyncio
+from collections import deque
+from typing import List, Optional
+
+import anyio
+import anyio.to_thread
+import numpy as np
+
+from piper_core import (
+    BATCH_MAX,
+    BATCH_MAX_PADDING,
+    BATCH_WINDOW_MS,
+    LoadedVoice,
+    _apply_post_gain,
+    _wav_header,
+    piper,
+)
+
+# float -> int16 scale, as in piper.AudioChunk
+_MAX_WAV_VALUE = 32767.0
+
+
+class _Request:
+    """A queued request and its per-sentence audio as the group's batches complete."""
+    __slots__ = ("key", "loaded", "text", "syn_config", "volume", "future", "audio", "remaining", "failed")
+
+    def __init__(self, key: tuple, loaded: LoadedVoice, text: str, syn_config, volume: Optional[float], future: asyncio.Future):
+        self.key = key
+        self.loaded = loaded
+        self.text = text
+        self.syn_config = syn_config
+        self.volume = volume
+        self.future = future
+        self.audio: List[Optional[np.ndarray]] = []
+        self.remaining = 0
+        self.failed = False
+
+
+def _scales(voice, syn_config) -> tuple:
+    """(noise_scale, length_scale, noise_w_scale) with the voice's defaults filled in"""
+    cfg = voice.config
+    return (
+        cfg.noise_scale if syn_config.noise_scale is None else syn_config.noise_scale,
+        cfg.length_scale if syn_config.length_scale is None else syn_config.length_scale,
+        cfg.noise_w_scale if syn_config.noise_w_scale is None else syn_config.noise_w_scale,
+    )
+
+
+def _speaker(voice, syn_config) -> Optional[int]:
+    if voice.config.num_speakers <= 1:
+        return None
+    return voice.config.default_speaker_id if syn_config.speaker_id is None else syn_config.speaker_id
+
+
+class SynthesisCoalescer:
+    """Collects synthesis requests for a short window and runs them as padded ONNX batches."""
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_batch: int = BATCH_MAX,
+                 limiter: Optional[anyio.CapacityLimiter] = None):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.limiter = limiter
+        self._pending: deque = deque()
+        self._collector: Optional[asyncio.Task] = None
+        self._jobs: set = set()
+
+    async def submit(self, voice_name: str, loaded: LoadedVoice, text: str, syn_config, volume: Optional[float]) -> bytes:
+        """Queue a request and wait for its complete WAV bytes."""
+        if syn_config is None:
+            syn_config = piper.SynthesisConfig()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (voice_name, _scales(loaded.voice, syn_config))
+        self._pending.append(_Request(key, loaded, text, syn_config, volume, future))
+        if self._collector is None:
+            self._collector = asyncio.create_task(self._collect())
+        return await future
+
+    async def _collect(self) -> None:
+        await asyncio.sleep(self.window)
+        self._collector = None
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            # Take up to max_batch requests sharing the oldest request's voice and scales
+            key = self._pending[0].key
+            group, rest = [], deque()
+            for request in self._pending:
+                if request.key == key and len(group) < self.max_batch:
+                    group.append(request)
+                else:
+                    rest.append(request)
+            self._pending = rest
+
+            job = asyncio.ensure_future(
+                anyio.to_thread.run_sync(self._render_group, loop, group, limiter=self.limiter)
+            )
+            self._jobs.add(job)
+            job.add_done_callback(self._jobs.discard)
+
+    def _render_group(self, loop: asyncio.AbstractEventLoop, group: List[_Request]) -> None:
+        voice = group[0].loaded.voice
+        scales = group[0].key[1]
+
+        sentences = []  # (request, sentence index, phoneme ids)
+        for request in group:
+            if request.future.cancelled():
+                continue
+            try:
+                ids = [voice.phonemes_to_ids(p) for p in voice.phonemize(request.text) if p]
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_exception, request.future, e)
+                continue
+            request.audio = [None] * len(ids)
+            request.remaining = len(ids)
+            if not ids:
+                loop.call_soon_threadsafe(_set_result, request.future, _finish(request))
+            sentences.extend((request, i, s) for i, s in enumerate(ids))
+
+        # Without w_ceil there is no way to trim padded output; run sentences alone
+        batch_size = self.max_batch if len(voice.session.get_outputs()) > 1 else 1
+        sentences.sort(key=lambda s: len(s[2]))
+        for batch in _split(sentences, batch_size):
+            batch = [s for s in batch if not s[0].failed]
+            if not batch:
+                continue
+            try:
+                audios = _run_batch(voice, scales, batch)
+            except Exception as e:
+                for request, _, _ in batch:
+                    if not request.failed:
+                        request.failed = True
+                        loop.call_soon_threadsafe(_set_exception, request.future, e)
+                continue
+            # Resolve each request as soon as its last sentence is done
+            for (request, i, _), audio in zip(batch, audios):
+                request.audio[i] = _to_int16(audio, request.syn_config)
+                request.remaining -= 1
+                if request.remaining == 0:
+                    loop.call_soon_threadsafe(_set_result, request.future, _finish(request))
+
+
+def _split(sentences: list, batch_size: int):
+    """Split length-sorted sentences into batches with bounded padding."""
+    batch: list = []
+    for sentence in sentences:
+        if batch and (len(batch) >= batch_size or len(sentence[2]) > len(batch[0][2]) * (1 + BATCH_MAX_PADDING)):
+            yield batch
+            batch = []
+        batch.append(sentence)
+    if batch:
+        yield batch
+
+
+def _run_batch(voice, scales: tuple, batch: list) -> List[np.ndarray]:
+    """One session.run() over the batch's padded phoneme ids; float audio per item, padding trimmed off"""
+    lengths = np.array([len(ids) for _, _, ids in batch], dtype=np.int64)
+    pad_id = voice.config.phoneme_id_map.get("_", [0])[0]
+    phoneme_ids = np.full((len(batch), int(lengths.max())), pad_id, dtype=np.int64)
+    for b, (_, _, ids) in enumerate(batch):
+        phoneme_ids[b, :len(ids)] = ids
+
+    args = {
+        "input": phoneme_ids,
+        "input_lengths": lengths,
+        "scales": np.array(scales, dtype=np.float32),
+    }
+    speakers = [_speaker(voice, request.syn_config) for request, _, _ in batch]
+    if speakers[0] is not None:
+        args["sid"] = np.array(speakers, dtype=np.int64)
+
+    result = voice.session.run(None, args)
+    audio = result[0].reshape(len(batch), -1)  # [B, 1, time] -> [B, time], padded to the longest
+    if len(batch) == 1:
+        return [audio[0]]
+    # w_ceil: frames per phoneme id, zero past each item's input_lengths
+    frames = result[1].reshape(len(batch), -1).sum(axis=1)
+    hop = voice.config.hop_length
+    return [audio[b, :int(frames[b]) * hop] for b in range(len(batch))]
+
+
+def _to_int16(audio: np.ndarray, syn_config) -> np.ndarray:
+    # Same post-processing as PiperVoice.synthesize()
+    if syn_config.normalize_audio:
+        peak = np.max(np.abs(audio)) if audio.size else 0.0
+        audio = audio / peak if peak >= 1e-8 else np.zeros_like(audio)
+    if syn_config.volume != 1.0:
+        audio = audio * syn_config.volume
+    return np.clip(audio * _MAX_WAV_VALUE, -_MAX_WAV_VALUE, _MAX_WAV_VALUE).astype(np.int16)
+
+
+def _finish(request: _Request) -> bytes:
+    """The request's complete WAV file"""
+    pcm = np.concatenate(request.audio).tobytes() if request.audio else b""
+    data = _apply_post_gain(pcm, request.volume)
+    return b"".join((_wav_header(request.loaded.sample_rate, len(data)), data))
+
+
+def _set_result(future: asyncio.Future, result) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exc: BaseException) -> None:
+    if not future.done():
+        future.set_exception(exc)
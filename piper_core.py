@@ -0,0 +1,239 @@
+"""
+Shared Piper TTS core used by the HTTP API (main.py) and the MCP server (mcp_server.py).
+
+Holds configuration, voice discovery and loading, and WAV rendering, so both
+entry points share one set of loaded voices and caches. Diagnostics go to stderr:
+stdout carries the protocol under the MCP stdio server, and voice worker
+processes inherit it.
+"""
+
+import io
+import json
+import os
+import struct
+import sys
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+
+from gain import apply_gain, apply_gain_into
+# ESPEAK_DATA_PATH, GPU and ONNXRuntime thread settings live with voice construction
+from piper_voice import _get_sample_rate, _open_voice, piper
+
+# -------- Config via env vars --------
+# Directory containing Piper models (.onnx files with corresponding .json configs)
+# Example: export PIPER_MODELS_DIR="path/to/models"
+PIPER_MODELS_DIR = os.getenv("PIPER_MODELS_DIR", "./models")
+
+# Serve <voice>.int8.onnx (see tools/quantize_voice.py) instead of <voice>.onnx where
+# available. Uses the FP32 model's <voice>.onnx.json config. Helps CPU inference only.
+USE_QUANTIZED = os.getenv("PIPER_QUANTIZED", "0") == "1"
+QUANTIZED_SUFFIX = ".int8.onnx"
+
+# Run each voice's ONNX session in a dedicated worker process (see piper_worker.py)
+# instead of in the serving process
+WORKER_PROCESS = os.getenv("PIPER_WORKER_PROCESS", "0") == "1"
+
+# Coalesce /synthesize requests arriving within this many ms into padded batch ONNX
+# calls (see piper_batch.py); 0 disables it
+BATCH_WINDOW_MS = float(os.getenv("PIPER_BATCH_WINDOW_MS", "0"))
+# Maximum number of requests per coalesced group, and of sentences per ONNX call
+BATCH_MAX = int(os.getenv("PIPER_BATCH_MAX", "8"))
+# Sentences share an ONNX call only while the longest is at most this fraction longer
+# (in phoneme ids) than the shortest, which bounds the compute spent on padding
+BATCH_MAX_PADDING = float(os.getenv("PIPER_BATCH_MAX_PADDING", "0.5"))
+
+# -------- Data models --------
+class SynthesisRequest(BaseModel):
+    text: str = Field(..., description="Plain UTF-8 text to synthesize")
+    # Optional per-request voice params
+    speaker: Optional[int] = Field(None, description="Multi-speaker index (if model supports)")
+    noise_scale: Optional[float] = Field(None, description="Generator noise (default 0.667)")
+    length_scale: Optional[float] = Field(None, description="Phoneme length (default 1.0)")
+    noise_w: Optional[float] = Field(None, description="Phoneme width noise (default 0.8)")
+    sentence_silence: Optional[float] = Field(None, description="Seconds of silence after each sentence (default 0.2)")
+    rate: Optional[float] = Field(None, description="Convenience: multiply length_scale inversely, e.g., 1.05=faster, 0.95=slower")
+    volume: Optional[float] = Field(None, description="Post gain multiplier on PCM frames (e.g., 1.2 = +20%)")
+
+# Parsed <model>.onnx.json per voice, read once during discovery (configs are static)
+VOICE_CONFIGS: Dict[str, dict] = {}
+
+# Discover available models from directory
+def _discover_models() -> Dict[str, str]:
+    """Scan PIPER_MODELS_DIR for .onnx files and return voice_name -> model_path mapping"""
+    models = {}
+    if not os.path.exists(PIPER_MODELS_DIR):
+        print(f"[WARN] Models directory not found: {PIPER_MODELS_DIR}", file=sys.stderr)
+        return models
+    
+    try:
+        # One directory pass; DirEntry carries the name/path, so no per-file stat is needed
+        names = set()
+        onnx = {}
+        with os.scandir(PIPER_MODELS_DIR) as entries:
+            for entry in entries:
+                names.add(entry.name)
+                if entry.name.endswith('.onnx'):
+                    onnx[entry.name] = entry.path
+
+        for filename, model_path in onnx.items():
+            # Only include models that have corresponding config files
+            if filename + '.json' in names:
+                # Use filename without extension as voice name
+                voice_name = filename[:-5]  # Remove .onnx
+                models[voice_name] = model_path
+                try:
+                    with open(model_path + '.json', 'r', encoding='utf-8') as f:
+                        VOICE_CONFIGS[voice_name] = json.load(f)
+                except Exception as e:
+                    print(f"[WARN] Failed to read config file for {filename}: {e}", file=sys.stderr)
+                # Serve the INT8 variant (same config) if one was generated
+                quantized = voice_name + QUANTIZED_SUFFIX
+                if USE_QUANTIZED and quantized in onnx:
+                    models[voice_name] = onnx[quantized]
+            elif filename.endswith(QUANTIZED_SUFFIX):
+                # Quantized variant of another voice, picked up above with PIPER_QUANTIZED=1
+                continue
+            else:
+                print(f"[WARN] Missing config file for {filename}, skipping", file=sys.stderr)
+    except Exception as e:
+        print(f"[ERROR] Failed to scan models directory: {e}", file=sys.stderr)
+    
+    return models
+
+VOICES: Dict[str, str] = _discover_models()
+
+if not VOICES:
+    print(f"[WARN] No models found in {PIPER_MODELS_DIR}. Ensure .onnx files have corresponding .json configs.", file=sys.stderr)
+else:
+    print(f"[INFO] Discovered {len(VOICES)} voice models: {list(VOICES.keys())}", file=sys.stderr)
+
+class LoadedVoice(NamedTuple):
+    """A loaded voice with the per-model values probed once at load"""
+    voice: object
+    # Sample rate (fixed for a model)
+    sample_rate: int
+    # Streaming (unknown-length) WAV header
+    wav_header: bytes
+
+# Cache of loaded voices. Callers get the whole entry from _load_voice, so evicting
+# a dead worker never pulls the sample rate or header out from under a request.
+_loaded_voices: Dict[str, LoadedVoice] = {}
+
+# One lock per voice: concurrent first requests load it once, other voices aren't held up
+_load_locks: Dict[str, threading.Lock] = {name: threading.Lock() for name in VOICES}
+
+def _load_voice(name: str) -> LoadedVoice:
+    loaded = _loaded_voices.get(name)
+    if loaded is not None and getattr(loaded.voice, "alive", True):
+        return loaded
+    model_path = VOICES.get(name)
+    if not model_path:
+        raise HTTPException(status_code=404, detail=f"Voice '{name}' not found")
+    config = VOICE_CONFIGS.get(name)
+    if config is None:
+        # Some distros store config alongside with different naming; fail clearly
+        raise HTTPException(status_code=400, detail=f"Config JSON not found or unreadable for model: {model_path}. Expected {model_path}.json")
+    with _load_locks[name]:
+        loaded = _loaded_voices.get(name)
+        if loaded is not None:
+            if getattr(loaded.voice, "alive", True):
+                return loaded
+            # Worker process died (e.g. OOM-killed); drop it so a new one is started
+            print(f"[WARN] Worker for voice {name} exited, restarting it", file=sys.stderr)
+            _evict_voice(name)
+        # loads and warms the model
+        # Batching trims padded output with the model's alignment (w_ceil) output
+        voice = (_connect_worker(model_path, config) if WORKER_PROCESS
+                 else _open_voice(model_path, config, alignments=BATCH_WINDOW_MS > 0))
+        sr = _get_sample_rate(voice)
+        loaded = _loaded_voices[name] = LoadedVoice(voice, sr, _wav_header(sr))
+    return loaded
+
+def _evict_voice(name: str) -> None:
+    loaded = _loaded_voices.pop(name, None)
+    close = getattr(loaded.voice, "close", None) if loaded is not None else None
+    if close is not None:
+        close()
+
+def _connect_worker(model_path: str, config: dict):
+    """Start a worker process for the model and return a proxy with PiperVoice's synthesize()"""
+    from piper_worker import VoiceWorker
+    return VoiceWorker(model_path, config)
+
+# RIFF/data size for a stream whose length isn't known up front
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+def _wav_header(sr: int, data_size: int = WAV_UNKNOWN_SIZE) -> bytes:
+    """44-byte RIFF/WAVE header for mono 16-bit PCM at ``sr`` Hz"""
+    riff_size = WAV_UNKNOWN_SIZE if data_size == WAV_UNKNOWN_SIZE else 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sr, sr * 2, 2, 16,  # PCM, mono, byte rate, block align, 16-bit
+        b"data", data_size,
+    )
+
+def _build_synthesis_config(req: SynthesisRequest):
+    """Piper SynthesisConfig for the request's voice parameters, or None to use the voice defaults"""
+    # Convert "rate" to Piper length_scale if provided:
+    # Higher rate -> faster speech -> smaller length_scale
+    length_scale = req.length_scale
+    if req.rate and not length_scale:
+        # simple mapping: length_scale = 1 / rate
+        try:
+            length_scale = 1.0 / float(req.rate)
+        except Exception:
+            pass
+
+    if all(x is None for x in (req.speaker, req.noise_scale, length_scale,
+                               req.noise_w, req.sentence_silence)):
+        return None
+    syn_config = piper.SynthesisConfig()
+    if req.speaker is not None:          syn_config.speaker_id = req.speaker
+    if req.noise_scale is not None:      syn_config.noise_scale = float(req.noise_scale)
+    if length_scale is not None:         syn_config.length_scale = float(length_scale)
+    if req.noise_w is not None:          syn_config.noise_w = float(req.noise_w)
+    if req.sentence_silence is not None: syn_config.sentence_silence = float(req.sentence_silence)
+    return syn_config
+
+def _apply_post_gain(pcm_bytes: bytes, volume: Optional[float]):
+    """``pcm_bytes`` scaled by ``volume``, as bytes or a byte memoryview (both streamable)"""
+    if not volume or abs(volume - 1.0) < 1e-6:
+        return pcm_bytes
+    # 16-bit signed PCM
+    return apply_gain(pcm_bytes, float(volume))
+
+def _write_wav(fp, voice, sr: int, text: str, syn_config, volume: Optional[float]) -> None:
+    """Synthesize ``text`` as a WAV file into the seekable binary file ``fp`` (blocking)"""
+    # Placeholder header, raw PCM writes, then patch the RIFF/data sizes once at the end
+    start = fp.tell()
+    fp.write(_wav_header(sr))
+
+    # Gain is written into one reusable scratch buffer and handed to the file as a view,
+    # instead of allocating a new bytes object per chunk
+    gain = float(volume) if volume and abs(volume - 1.0) > 1e-6 else None
+    scratch = bytearray()
+    data_size = 0
+    for chunk in voice.synthesize(text, syn_config):
+        audio_data = chunk.audio_int16_bytes
+        if gain is not None:
+            if len(scratch) < len(audio_data):
+                scratch = bytearray(len(audio_data))
+            n = apply_gain_into(audio_data, scratch, gain)
+            audio_data = memoryview(scratch)[:n]
+        fp.write(audio_data)
+        data_size += len(audio_data)
+
+    end = fp.tell()
+    fp.seek(start)
+    fp.write(_wav_header(sr, data_size))
+    fp.seek(end)
+
+def _render_wav(voice, sr: int, text: str, syn_config, volume: Optional[float]) -> bytes:
+    """Synthesize ``text`` into a complete in-memory WAV file (blocking; run it in the threadpool)"""
+    buf = io.BytesIO()
+    _write_wav(buf, voice, sr, text, syn_config, volume)
+    return buf.getvalue()
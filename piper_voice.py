@@ -0,0 +1,100 @@
+"""
+Piper voice construction: ONNXRuntime session setup and PiperVoice creation.
+
+Kept apart from piper_core so voice worker processes (piper_worker.py) can
+open a voice without running model discovery or loading the gain kernels.
+"""
+
+import os
+import sys
+from typing import Optional
+
+# -------- Config via env vars --------
+# eSpeak NG data path (needed by Piper phonemizer)
+# On Arch: /usr/share/espeak-ng-data
+ESPEAK_DATA_PATH = os.getenv("ESPEAK_DATA_PATH", "/usr/share/espeak-ng-data")
+
+# Run inference on the GPU via ONNXRuntime's CUDA provider (requires onnxruntime-gpu
+# built for the installed CUDA/cuDNN versions). CPU stays registered as fallback.
+USE_CUDA = os.getenv("PIPER_USE_CUDA", "0") == "1"
+
+# Heuristic conv algo selection avoids cuDNN's exhaustive per-shape autotune, which
+# VITS' variable-length inputs would otherwise trigger on nearly every call.
+CUDA_PROVIDERS = [
+    ("CUDAExecutionProvider", {"cudnn_conv_algo_search": "HEURISTIC"}),
+    "CPUExecutionProvider",
+]
+
+# ONNXRuntime intra-op threads per session. ORT gives each session one intra-op pool,
+# shared by all concurrent Run() calls on it, and every loaded voice (or voice worker
+# process) has its own session. 0 keeps ORT's default of one thread per physical core.
+# PIPER_EXPECTED_CONCURRENCY instead splits the available logical CPUs across that many
+# sessions inferring at once, e.g. the number of voices served concurrently.
+# Inter-op parallelism is off (the VITS graph is a single chain).
+EXPECTED_CONCURRENCY = int(os.getenv("PIPER_EXPECTED_CONCURRENCY", "0"))
+_DEFAULT_INTRA_THREADS = max(1, (os.process_cpu_count() or 1) // EXPECTED_CONCURRENCY) if EXPECTED_CONCURRENCY > 0 else 0
+INTRA_THREADS = int(os.getenv("PIPER_INTRA_THREADS", str(_DEFAULT_INTRA_THREADS)))
+
+# Ensure ESPEAK_DATA_PATH for Piper
+os.environ.setdefault("ESPEAK_DATA_PATH", ESPEAK_DATA_PATH)
+
+# Imported after the ESPEAK_DATA_PATH default above; None lets the module load without piper-tts
+try:
+    import piper  # type: ignore
+except ImportError:
+    piper = None
+
+
+def _open_voice(model_path: str, config: dict, alignments: bool = False):
+    """
+    PiperVoice for the model. With ``alignments`` the session also outputs w_ceil, the
+    per-phoneme-id frame counts (needed to trim padded batch output, see piper_batch.py).
+    """
+    # PiperVoice.load doesn't take session options, so build the session ourselves
+    if piper is None:
+        raise RuntimeError("piper-tts is not installed (pip install piper-tts)")
+    import onnxruntime as ort  # type: ignore
+    if USE_CUDA and "CUDAExecutionProvider" not in ort.get_available_providers():
+        print("[WARN] PIPER_USE_CUDA=1 but CUDAExecutionProvider is unavailable (is onnxruntime-gpu installed?)", file=sys.stderr)
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if INTRA_THREADS > 0:
+        so.intra_op_num_threads = INTRA_THREADS
+    so.inter_op_num_threads = 1
+    providers = CUDA_PROVIDERS if USE_CUDA else ["CPUExecutionProvider"]
+    model = _alignment_model(model_path) if alignments else None
+    session = ort.InferenceSession(model or model_path, sess_options=so, providers=providers)
+    opts = session.get_session_options()
+    print(f"[INFO] Loaded {model_path}: providers={session.get_providers()}, "
+          f"intra_op_threads={opts.intra_op_num_threads or 'ORT default'}, inter_op_threads={opts.inter_op_num_threads}",
+          file=sys.stderr)
+    return piper.PiperVoice(config=piper.PiperConfig.from_dict(config), session=session)
+
+
+def _alignment_model(model_path: str) -> Optional[bytes]:
+    """The model with w_ceil marked as an output, or None to load the file as-is"""
+    try:
+        import onnx  # type: ignore
+        from piper.patch_voice_with_alignment import add_alignment_output
+    except ImportError:
+        print(f"[WARN] The onnx package is needed to expose alignments for {model_path} (pip install onnx)", file=sys.stderr)
+        return None
+    model = onnx.load(model_path)
+    try:
+        add_alignment_output(model)
+    except ValueError as e:
+        # Already patched (e.g. with piper.patch_voice_with_alignment), or no Ceil tensor
+        print(f"[WARN] Not patching {model_path} for alignments, using it as-is: {e}", file=sys.stderr)
+        return None
+    return model.SerializeToString()
+
+
+def _get_sample_rate(voice) -> int:
+    # PiperVoice usually exposes sample rate via attribute or config; try both
+    for obj in (voice, getattr(voice, "config", None)):
+        for attr in ("sample_rate_hz", "sample_rate"):
+            sr = getattr(obj, attr, None)
+            if isinstance(sr, int) and sr > 0:
+                return sr
+    # last resort: 22050 (typical for many voices)
+    return 22050
@@ -0,0 +1,206 @@
+"""
+Out-of-process voice workers for Piper TTS.
+
+With PIPER_WORKER_PROCESS=1 each voice's ONNX session lives in a dedicated
+worker process instead of the serving process. The serving side talks to it
+through a VoiceWorker proxy that mimics PiperVoice.synthesize(): requests and
+control messages travel over a Pipe, and each synthesized PCM chunk is handed
+back through a shared-memory block owned by the proxy.
+
+The worker synthesizes one request at a time and only produces the next chunk
+once the previous one has been copied out of shared memory. A reader thread in
+the proxy does that copy as soon as a chunk arrives and routes it to the
+requesting generator's queue, so a slow consumer (e.g. a client downloading a
+stream) never holds up other requests to the same voice.
+"""
+
+import atexit
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from multiprocessing import shared_memory
+
+# Shared-memory block per worker; larger chunks fall back to being sent over the Pipe
+SHM_BYTES = int(os.getenv("PIPER_WORKER_SHM_BYTES", str(4 * 1024 * 1024)))
+
+# Marks the end of a request's chunk queue
+_END = object()
+
+
+class _WorkerChunk:
+    """Minimal stand-in for piper.AudioChunk: just the PCM bytes."""
+    __slots__ = ("audio_int16_bytes",)
+
+    def __init__(self, audio_int16_bytes: bytes):
+        self.audio_int16_bytes = audio_int16_bytes
+
+
+def _worker_main(conn, shm_name: str, model_path: str, config: dict) -> None:
+    """Worker process entry point: load the voice, then serve synthesis requests."""
+    # piper_voice rather than piper_core, so the worker skips model discovery
+    from piper_voice import _get_sample_rate, _open_voice
+
+    try:
+        voice = _open_voice(model_path, config)
+    except Exception as e:
+        conn.send(("error", None, f"Failed to load {model_path}: {e}"))
+        return
+    # The proxy owns (and unlinks) the block; don't let this process's tracker touch it
+    shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    conn.send(("ready", None, _get_sample_rate(voice)))
+
+    # Requests that arrive while a chunk is waiting for its ack
+    backlog = deque()
+    try:
+        while True:
+            if backlog:
+                request = backlog.popleft()
+            else:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+            if request is None:
+                break
+            req_id, text, syn_config = request
+            try:
+                for chunk in voice.synthesize(text, syn_config):
+                    data = chunk.audio_int16_bytes
+                    if len(data) <= shm.size:
+                        shm.buf[:len(data)] = data
+                        conn.send(("chunk", req_id, len(data)))
+                    else:
+                        conn.send(("bytes", req_id, data))
+                    # Wait until the chunk has been copied out before overwriting the block
+                    ack = conn.recv()
+                    while not isinstance(ack, str):
+                        backlog.append(ack)
+                        ack = conn.recv()
+                    if ack != "next":
+                        break
+                else:
+                    conn.send(("end", req_id, None))
+            except EOFError:
+                break
+            except Exception as e:
+                conn.send(("error", req_id, str(e)))
+    finally:
+        shm.close()
+
+
+class VoiceWorker:
+    """Proxy for a voice loaded in a worker process."""
+
+    def __init__(self, model_path: str, config: dict):
+        # spawn: never fork a process that may already be running ONNXRuntime/threadpool threads
+        ctx = mp.get_context("spawn")
+        self._shm = shared_memory.SharedMemory(create=True, size=SHM_BYTES)
+        self._conn, child_conn = ctx.Pipe()
+        self._send_lock = threading.Lock()
+        self._requests = {}
+        self._ids = itertools.count()
+        self._dead = False
+        self._process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self._shm.name, model_path, config),
+            name=f"piper-worker-{os.path.basename(model_path)}",
+            daemon=True,
+        )
+        self._process.start()
+        child_conn.close()
+
+        try:
+            kind, _, payload = self._conn.recv()
+        except (EOFError, OSError):
+            kind, payload = "error", f"Voice worker for {model_path} exited during startup"
+        if kind != "ready":
+            self.close()
+            raise RuntimeError(payload)
+        self.sample_rate: int = payload
+        self._reader = threading.Thread(target=self._read_loop, name=f"{self._process.name}-reader", daemon=True)
+        self._reader.start()
+        atexit.register(self.close)
+        print(f"[INFO] Started worker process {self._process.pid} for {model_path}", file=sys.stderr)
+
+    @property
+    def alive(self) -> bool:
+        """False once the worker process has exited or its pipe has broken."""
+        return not self._dead and self._process.is_alive()
+
+    def _send(self, message) -> None:
+        try:
+            with self._send_lock:
+                self._conn.send(message)
+        except (OSError, ValueError):
+            self._mark_dead()
+            raise RuntimeError(f"Voice worker {self._process.name} exited unexpectedly")
+
+    def _mark_dead(self) -> None:
+        self._dead = True
+        # Fail every request still waiting on this worker
+        for q in list(self._requests.values()):
+            q.put(RuntimeError(f"Voice worker {self._process.name} exited unexpectedly"))
+
+    def _read_loop(self) -> None:
+        while True:
+            try:
+                kind, req_id, payload = self._conn.recv()
+            except (EOFError, OSError):
+                self._mark_dead()
+                return
+            q = self._requests.get(req_id)
+            if kind in ("chunk", "bytes"):
+                data = bytes(self._shm.buf[:payload]) if kind == "chunk" else payload
+                # Ack right away; a consumer that went away (e.g. client disconnect) cancels the rest
+                try:
+                    self._send("next" if q is not None else "cancel")
+                except RuntimeError:
+                    return
+                if q is not None:
+                    q.put(data)
+            elif q is not None:
+                q.put(_END if kind == "end" else RuntimeError(payload))
+
+    def synthesize(self, text: str, syn_config=None):
+        """Yield chunks with ``audio_int16_bytes``, like PiperVoice.synthesize()."""
+        if not self.alive:
+            raise RuntimeError(f"Voice worker {self._process.name} is not running")
+        req_id = next(self._ids)
+        q = queue.SimpleQueue()
+        self._requests[req_id] = q
+        try:
+            if self._dead:
+                raise RuntimeError(f"Voice worker {self._process.name} exited unexpectedly")
+            self._send((req_id, text, syn_config))
+            while True:
+                item = q.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield _WorkerChunk(item)
+        finally:
+            self._requests.pop(req_id, None)
+
+    def close(self) -> None:
+        if self._shm is None:
+            return
+        self._dead = True
+        try:
+            with self._send_lock:
+                self._conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+        atexit.unregister(self.close)
@@ -8,8 +8,11 @@ Usage: python run_mcp_server.py
 
 import asyncio
 import sys
-from mcp_server import main
 
 if __name__ == "__main__":
+    # Imported here, not at module level: spawned voice worker processes re-import
+    # this script, and mcp_server would rerun model discovery in each of them
+    from mcp_server import main
+
     print("Starting Piper TTS MCP Server...", file=sys.stderr)
     asyncio.run(main())
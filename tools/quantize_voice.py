@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Quantize Piper voice models to INT8 with ONNXRuntime dynamic quantization.
+
+Writes <voice>.int8.onnx next to each <voice>.onnx. The FP32 model and its
+.onnx.json config are left untouched; the server keeps serving the FP32 model
+unless started with PIPER_QUANTIZED=1, so both can be compared on the same voice.
+
+INT8 helps CPU inference, which is bandwidth-bound on the model weights. It
+does not help on GPU, where the VITS decoder is bound by kernel launches.
+
+Usage: python tools/quantize_voice.py path/to/models/*.onnx
+Requires the onnx package (pip install onnx) in addition to onnxruntime.
+"""
+
+import argparse
+import os
+import sys
+
+QUANTIZED_SUFFIX = ".int8.onnx"
+
+
+def quantized_path(model_path: str) -> str:
+    return model_path[:-len(".onnx")] + QUANTIZED_SUFFIX
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("models", nargs="+", help="FP32 Piper .onnx models to quantize")
+    parser.add_argument("--weight-type", choices=("qint8", "quint8"), default="qint8",
+                        help="Weight data type (default: qint8)")
+    parser.add_argument("--per-channel", action="store_true",
+                        help="Quantize weights per channel (better quality, slightly larger)")
+    parser.add_argument("--force", action="store_true", help="Overwrite existing .int8.onnx files")
+    args = parser.parse_args()
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    weight_type = QuantType.QInt8 if args.weight_type == "qint8" else QuantType.QUInt8
+    failed = 0
+    for model_path in args.models:
+        if not model_path.endswith(".onnx") or model_path.endswith(QUANTIZED_SUFFIX):
+            print(f"[WARN] Skipping {model_path}: not an FP32 .onnx model", file=sys.stderr)
+            continue
+        out_path = quantized_path(model_path)
+        if os.path.exists(out_path) and not args.force:
+            print(f"[INFO] {out_path} already exists, skipping (use --force to overwrite)")
+            continue
+        try:
+            quantize_dynamic(model_path, out_path, weight_type=weight_type, per_channel=args.per_channel)
+        except Exception as e:
+            print(f"[ERROR] Failed to quantize {model_path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        before, after = os.path.getsize(model_path), os.path.getsize(out_path)
+        print(f"[INFO] {model_path} -> {out_path} ({before / 1e6:.1f} MB -> {after / 1e6:.1f} MB)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())